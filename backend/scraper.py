@@ -2,7 +2,10 @@
 
 from __future__ import annotations
 from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import io
+import os
 import tempfile
 import json
 import uuid
@@ -13,8 +16,8 @@ from urllib.parse import urlparse
 
 from playwright.sync_api import sync_playwright, TimeoutError as PwTimeout
 from PIL import Image
+import lxml.html
 import numpy as np
-from sklearn.cluster import KMeans
 
 
 @dataclass
@@ -31,6 +34,10 @@ class ScrapeBundle:
     link_icons: list[str]
     script_tags: list[str]
 
+    # Raw PNG kept in memory so downstream encoding skips the disk
+    # round-trip; deliberately left out of to_dict().
+    screenshot_bytes: bytes = b""
+
     def to_dict(self) -> dict:
         return {
             "url": self.url,
@@ -46,59 +53,201 @@ class ScrapeBundle:
         }
 
 
+# Set ORCHIDS_PALETTE_KMEANS=1 to use the (slower) KMeans clustering path.
+_USE_KMEANS = os.environ.get("ORCHIDS_PALETTE_KMEANS") == "1"
+
+# Hot-path patterns, compiled once at import instead of per scrape.
+_RE_CSS_LINK = re.compile(
+    r'<link[^>]+rel=["\']stylesheet["\'][^>]*href=["\']([^"\']+)["\']', re.I
+)
+_RE_META = re.compile(r'(<meta\b[^>]*>)', re.I)
+_RE_ICON = re.compile(
+    r'<link[^>]+rel=["\']icon["\'][^>]*href=["\']([^"\']+)["\']', re.I
+)
+_RE_SCRIPT = re.compile(r'(<script\b[^>]*?>.*?</script>)', re.I | re.S)
+
+# Palette extraction is pure CPU and only needs the PNG bytes, so it runs
+# on this thread while the rest of the scrape (DOM extraction, context
+# teardown) is still talking to the browser.
+_PAL_POOL = ThreadPoolExecutor(max_workers=1)
+
+# Single batched extraction run inside the page: one CDP round-trip
+# returns every asset list at once, built by the browser's own DOM.
+_EXTRACT_JS = """
+() => {
+  const attr = (sel, name) =>
+    [...document.querySelectorAll(sel)].map(el => el.getAttribute(name)).filter(Boolean);
+  return {
+    css_links: attr('link[rel~="stylesheet"]', 'href'),
+    font_links: attr('link[href]', 'href').filter(h =>
+      /fonts\\.(googleapis|gstatic)\\.com|\\.woff2?(\\?|$)/.test(h)),
+    meta_tags: [...document.querySelectorAll('meta')].map(el => el.outerHTML),
+    link_icons: attr('link[rel~="icon"]', 'href'),
+    script_tags: [...document.querySelectorAll('script')].map(el => el.outerHTML),
+  };
+}
+"""
+
+# One warm Chromium per worker process; each job gets its own (cheap)
+# BrowserContext instead of paying the browser cold-start per scrape.
+_PW = None
+_BROWSER = None
+
+
+def _get_browser():
+    global _PW, _BROWSER
+    if _BROWSER is None or not _BROWSER.is_connected():
+        if _PW is None:
+            _PW = sync_playwright().start()
+        _BROWSER = _PW.chromium.launch(headless=True)
+    return _BROWSER
+
+
+def warm_browser() -> None:
+    """Launch the shared browser ahead of the first job (worker init hook)."""
+    _get_browser()
+
+
+def shutdown_browser() -> None:
+    """Close the shared browser and Playwright driver (worker shutdown hook)."""
+    global _PW, _BROWSER
+    if _BROWSER is not None:
+        try:
+            _BROWSER.close()
+        except Exception:
+            pass
+        _BROWSER = None
+    if _PW is not None:
+        try:
+            _PW.stop()
+        except Exception:
+            pass
+        _PW = None
+
+
+def _kmeans_centers(X: np.ndarray, k: int, iters: int = 10) -> np.ndarray:
+    """Plain Lloyd's iteration on float32 pixels.
+
+    The assignment step is a single GEMM (||x-c||^2 expanded as
+    x.x + c.c - 2x.c), so the hot loop is BLAS rather than sklearn's
+    validated/multi-restart pipeline — plenty for a k=5 color palette.
+    """
+    rng = np.random.default_rng(0)
+    C = X[rng.choice(len(X), k, replace=False)]
+    X2 = (X ** 2).sum(1)[:, None]
+    labels = None
+    for _ in range(iters):
+        D = X2 + (C ** 2).sum(1) - 2.0 * (X @ C.T)
+        new_labels = D.argmin(1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=k).astype(np.float32)
+        counts[counts == 0] = 1.0
+        C = np.stack([
+            np.bincount(labels, weights=X[:, c], minlength=k) / counts
+            for c in range(X.shape[1])
+        ], axis=1).astype(np.float32)
+    return C
+
+
 def _extract_palette(img: Image.Image, k: int = 5) -> list[str]:
-    arr = np.array(img).reshape(-1, 3)
-    km = KMeans(n_clusters=k, n_init="auto").fit(arr)
-    centers = km.cluster_centers_.astype(int)
-    return [f"#{r:02x}{g:02x}{b:02x}" for r, g, b in centers]
+    # Downsample first: palette quality is unaffected, pixel count drops ~20-50x.
+    img = img.convert("RGB")
+    img.thumbnail((256, 256), Image.Resampling.BILINEAR)
+
+    if _USE_KMEANS:
+        arr = np.array(img).reshape(-1, 3).astype(np.float32)
+        centers = _kmeans_centers(arr, k).astype(int)
+        return [f"#{r:02x}{g:02x}{b:02x}" for r, g, b in centers]
+
+    # Fast path: octree quantization runs entirely in C inside Pillow.
+    q = img.quantize(colors=k, method=Image.Quantize.FASTOCTREE)
+    pal = q.getpalette()[: k * 3]
+    return [f"#{r:02x}{g:02x}{b:02x}" for r, g, b in zip(pal[0::3], pal[1::3], pal[2::3])]
+
+
+def _extract_assets(dom_html: str) -> tuple[list[str], list[str], list[str], list[str]]:
+    """Collect stylesheet hrefs, meta tags, icon hrefs and script tags.
+
+    One C-level lxml parse and a single tree walk replace the four
+    full-document regex scans this used to take. Falls back to the regex
+    path if the document is too mangled to parse.
+    """
+    try:
+        tree = lxml.html.fromstring(dom_html)
+    except Exception:
+        return (
+            _RE_CSS_LINK.findall(dom_html),
+            _RE_META.findall(dom_html),
+            _RE_ICON.findall(dom_html),
+            _RE_SCRIPT.findall(dom_html),
+        )
+
+    css_links: list[str] = []
+    meta_tags: list[str] = []
+    link_icons: list[str] = []
+    script_tags: list[str] = []
+
+    for el in tree.iter("link", "meta", "script"):
+        if el.tag == "link":
+            rel = (el.get("rel") or "").lower()
+            href = el.get("href")
+            if not href:
+                continue
+            if "stylesheet" in rel:
+                css_links.append(href)
+            elif "icon" in rel:
+                link_icons.append(href)
+        elif el.tag == "meta":
+            meta_tags.append(lxml.html.tostring(el, encoding="unicode", with_tail=False))
+        else:
+            script_tags.append(lxml.html.tostring(el, encoding="unicode", with_tail=False))
+
+    return css_links, meta_tags, link_icons, script_tags
 
 
 def scrape(url: str) -> ScrapeBundle:
     job_dir = Path(tempfile.gettempdir()) / f"orchids_{uuid.uuid4().hex}"
     job_dir.mkdir(parents=True, exist_ok=True)
 
-    with sync_playwright() as pw:
-        browser = pw.chromium.launch(headless=True)
-        page = browser.new_page(viewport={"width": 1280, "height": 800})
+    browser = _get_browser()
+    context = browser.new_context(viewport={"width": 1280, "height": 800})
+    page = context.new_page()
 
+    try:
+        page.goto(url, timeout=45_000)
+        page.wait_for_load_state("networkidle")
+        dom_html = page.content()
+        shot_fp = job_dir / "hero.png"
+        # Playwright returns the PNG buffer even when writing to disk.
+        shot_bytes = page.screenshot(path=str(shot_fp), full_page=False)
+        # Kick off palette clustering now; it overlaps with the remaining
+        # CDP traffic and the context teardown below.
+        pal_future = _PAL_POOL.submit(_extract_palette, Image.open(io.BytesIO(shot_bytes)))
         try:
-            page.goto(url, timeout=45_000)
-            page.wait_for_load_state("networkidle")
-            dom_html = page.content()
-            shot_fp = job_dir / "hero.png"
-            page.screenshot(path=str(shot_fp), full_page=False)
-        except PwTimeout:
-            browser.close()
-            raise RuntimeError("Page load timed-out")
-        finally:
-            try:
-                browser.close()
-            except Exception:
-                pass
-
-    palette = _extract_palette(Image.open(shot_fp))
-
-    css_links = re.findall(
-        r'<link[^>]+rel=["\']stylesheet["\'][^>]*href=["\']([^"\']+)["\']',
-        dom_html,
-        flags=re.I
-    )
-
-    font_links: list[str] = []  # extend if needed
-
-    meta_tags = re.findall(r'(<meta\b[^>]*>)', dom_html, flags=re.I)
+            assets = page.evaluate(_EXTRACT_JS)
+        except Exception:
+            assets = None
+    except PwTimeout:
+        raise RuntimeError("Page load timed-out")
+    finally:
+        try:
+            context.close()
+        except Exception:
+            pass
 
-    link_icons = re.findall(
-        r'<link[^>]+rel=["\']icon["\'][^>]*href=["\']([^"\']+)["\']',
-        dom_html,
-        flags=re.I
-    )
+    palette = pal_future.result()
 
-    script_tags = re.findall(
-        r'(<script\b[^>]*?>.*?</script>)',
-        dom_html,
-        flags=re.I | re.S
-    )
+    if assets is not None:
+        css_links = assets["css_links"]
+        font_links = assets["font_links"]
+        meta_tags = assets["meta_tags"]
+        link_icons = assets["link_icons"]
+        script_tags = assets["script_tags"]
+    else:
+        css_links, meta_tags, link_icons, script_tags = _extract_assets(dom_html)
+        font_links = []
 
     return ScrapeBundle(
         url=url,
@@ -111,4 +260,5 @@ def scrape(url: str) -> ScrapeBundle:
         meta_tags=meta_tags,
         link_icons=link_icons,
         script_tags=script_tags,
+        screenshot_bytes=shot_bytes,
     )
@@ -3,21 +3,34 @@
 import os
 import re
 import json
+import hashlib
 import pathlib
 import tempfile
+import traceback
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from urllib.parse import urlparse
 
 from celery import Celery
+from celery.signals import (
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
 from redis import Redis
 from dotenv import load_dotenv
 import orjson
 import sass
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+import httpx
+import lxml.html
 import openai
 import requests
+from requests.adapters import HTTPAdapter
 
-from backend.scraper import scrape, ScrapeBundle
+from backend.scraper import scrape, ScrapeBundle, warm_browser, shutdown_browser
 
 
 # ───────── Environment & Infra ────────────────────────────────────────────
@@ -25,69 +38,286 @@ from backend.scraper import scrape, ScrapeBundle
 load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
 
 celery_app = Celery("orchids", broker="redis://localhost:6379/0")
+celery_app.conf.update(
+    # Clones run tens of seconds with highly variable LLM latency;
+    # prefetching several would let one worker hoard jobs while others idle.
+    worker_prefetch_multiplier=1,
+    # All job state lives in the jobs:{job_id} hash — never store return
+    # values in a result backend, so they can't pile up in Redis.
+    task_ignore_result=True,
+    # Compress task payloads on the broker; cheap insurance against large
+    # arguments ever bloating queue memory.
+    task_compression="gzip",
+    # acks_late + tens-of-seconds tasks: don't let the broker redeliver a
+    # clone that is still legitimately running.
+    broker_transport_options={"visibility_timeout": 3600},
+)
 redis      = Redis(host="localhost", port=6379, db=0, decode_responses=True)
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# Job artifacts go to tmpfs when available (override with ORCHIDS_TMPFS)
+# so the bundle/scss/html writes are memory-speed instead of disk IO.
+_tmpfs = pathlib.Path(os.environ.get("ORCHIDS_TMPFS", "/dev/shm"))
+TMP_ROOT = _tmpfs if _tmpfs.is_dir() else pathlib.Path(tempfile.gettempdir())
+
+# One explicit client with a sized keep-alive pool: every stage in every
+# job reuses the same TLS connections to api.openai.com instead of
+# renegotiating per call.
+openai_client = openai.OpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    http_client=httpx.Client(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        timeout=30.0,
+    ),
+)
+
+
+def _uses_prefork(sender) -> bool:
+    pool = getattr(sender, "pool_cls", "") or ""
+    name = pool if isinstance(pool, str) else getattr(pool, "__module__", "")
+    return "prefork" in name or "processes" in name
+
+
+# The worker_process_* signals are dispatched only by prefork children;
+# under the documented --pool=threads the main-process worker_init /
+# worker_shutdown signals are the ones that fire, so the hooks connect to
+# both. Warming is skipped in the prefork parent — a browser launched
+# before fork would hand every child a broken driver transport.
+
+@worker_init.connect
+def _init_browser_main(sender=None, **_kwargs):
+    if sender is not None and not _uses_prefork(sender):
+        _SCRAPE_POOL.submit(warm_browser)
+
+
+@worker_process_init.connect
+def _init_browser(**_kwargs):
+    # Pre-warm the shared Chromium so the first job doesn't pay cold-start.
+    _SCRAPE_POOL.submit(warm_browser)
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _teardown_browser(**_kwargs):
+    # shutdown_browser is a no-op when nothing was launched, so this is
+    # safe in whichever process(es) the signals fire.
+    _SCRAPE_POOL.submit(shutdown_browser).result()
+
+
+# Hot-path patterns, compiled once at import instead of per job.
+_RE_HEAD_STRIP  = re.compile(
+    r"<meta\s[^>]*?>|<link\s[^>]*?>|<title[^>]*?>.*?</title>", re.I | re.S
+)
+_RE_SCSS_FENCE  = re.compile(r"```(?:scss)?\n?", re.I)
+_RE_ROOT_URL    = re.compile(r'\b(href|src)="/')
+_RE_IMG         = re.compile(r'<img\s+([^>]*?)src="[^"]+"(.*?)>', re.I | re.S)
+# meta tags we emit ourselves and must not duplicate from the scrape
+_META_DROP      = re.compile(r"charset|viewport", re.I).search
+# two rule openings without an intervening close — i.e. nested selectors
+_RE_SCSS_NESTED = re.compile(r"[a-zA-Z][^{};]*\{[^}]*[a-zA-Z][^{};]*\{")
+
+
+# Pool for overlapping independent LLM calls; shared by every job in the
+# worker, so it must be sized for worker concurrency (up to 16 jobs with
+# the documented --concurrency=16, each holding a few calls in flight),
+# not for a single job — the httpx client pools 64 connections to match.
+_STAGE_POOL = ThreadPoolExecutor(max_workers=32)
+
+# Playwright's sync API is bound to the thread that created it, so when the
+# worker runs with --pool=threads/gevent all browser work is funnelled
+# through this single dedicated OS thread.
+_SCRAPE_POOL = ThreadPoolExecutor(max_workers=1)
+
+# Shared session so CSS fetches reuse TCP/TLS connections across jobs.
+_http = requests.Session()
+_http.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+_http.mount("http://", HTTPAdapter(pool_connections=8, pool_maxsize=16))
+
+
+def _fetch_css(css_url: str) -> str:
+    try:
+        resp = _http.get(css_url, timeout=5)
+        if resp.status_code == 200:
+            return f"/* {css_url} */\n{resp.text}"
+    except Exception:
+        pass
+    return ""
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(min=1, max=10))
-def chat(messages: list[dict], model: str, max_tokens: int) -> str:
-    response = openai.chat.completions.create(
+@lru_cache(maxsize=64)
+def _fetch_import(url: str) -> str:
+    try:
+        resp = _http.get(url, timeout=5)
+        if resp.status_code == 200:
+            return resp.text
+    except Exception:
+        pass
+    return ""
+
+
+def _cached_import(path: str):
+    # Resolve http(s) @imports (e.g. Google Fonts CSS) through a cached
+    # fetch so repeated jobs don't redo the network + libsass parse.
+    if path.startswith("http"):
+        return [(path, _fetch_import(path))]
+    return None
+
+
+# Retry only transient API failures, with jittered backoff so concurrent
+# stages don't retry in lockstep; anything else (bad request, auth) fails
+# fast. The per-call timeout keeps a single latency spike from stalling
+# the whole task.
+@retry(
+    stop=stop_after_attempt(4),
+    wait=wait_random_exponential(min=1, max=20),
+    retry=retry_if_exception_type(
+        (openai.APITimeoutError, openai.RateLimitError, openai.APIConnectionError)
+    ),
+    reraise=True,
+)
+def _chat_uncached(messages: list[dict], model: str, max_tokens: int) -> str:
+    response = openai_client.chat.completions.create(
         model=model,
         messages=messages,
         temperature=0,
         max_tokens=max_tokens,
+        timeout=30.0,
     )
     return response.choices[0].message.content
 
 
-def extract_json(text: str) -> dict:
+def chat(messages: list[dict], model: str, max_tokens: int) -> str:
+    # temperature=0 makes identical prompts reproducible, so reclones and
+    # retried jobs can reuse the stored response instead of re-billing.
+    blob = orjson.dumps({"m": model, "x": max_tokens, "msgs": messages})
+    key = "llm:" + hashlib.blake2b(blob, digest_size=16).hexdigest()
+    cached = redis.get(key)
+    if cached is not None:
+        return cached
+    content = _chat_uncached(messages, model, max_tokens)
+    redis.set(key, content, ex=86400 * 7)
+    return content
+
+
+def _hero_b64(bundle: ScrapeBundle) -> str:
+    """Base64-encode the hero screenshot, preferring the in-memory PNG."""
+    if bundle.screenshot_bytes:
+        return base64.b64encode(bundle.screenshot_bytes).decode("ascii")
+    path = pathlib.Path(bundle.screenshot_path)
+    if path.exists():
+        return base64.b64encode(path.read_bytes()).decode("ascii")
+    return ""
+
+
+def _strip_fence(s: str) -> str:
+    """Drop the surrounding ```scss fence via prefix/suffix slicing.
+
+    The model almost always emits exactly one fenced block, so this avoids
+    regex machinery and full-buffer replace scans for the common case.
+    """
+    s = s.strip()
+    if s.startswith("```"):
+        nl = s.find("\n")
+        s = s[nl + 1:] if nl != -1 else ""
+    if s.endswith("```"):
+        s = s[: s.rindex("```")]
+    return s
+
+
+def _looks_like_plain_css(s: str) -> bool:
+    """True when the blob uses no SCSS features (vars, mixins, nesting),
+    meaning it can be served as-is without a libsass pass."""
+    return (
+        "{" in s  # brace-less text (e.g. a refusal) isn't CSS at all
+        and "$" not in s
+        and "@mixin" not in s
+        and "@include" not in s
+        and not _RE_SCSS_NESTED.search(s)
+    )
+
+
+def _mark_progress(pipe, job_id: str, pct: int, extra: dict | None = None) -> None:
+    """Record progress on the job hash and push it to subscribers.
+
+    Both commands ride the job's pipeline, so they cost nothing until the
+    next stage-boundary flush; the publish is fire-and-forget and lets
+    consumers listen on jobs:{job_id}:progress instead of polling.
+    """
+    mapping: dict = {"progress": pct}
+    if extra:
+        mapping.update(extra)
+    pipe.hset(f"jobs:{job_id}", mapping=mapping)
+    pipe.publish(f"jobs:{job_id}:progress", pct)
+
+
+def extract_json(text: str) -> tuple[dict, str]:
     """
-    Attempts to find the first “{” and matching “}” in the LLM’s response,
-    slice out exactly that bracketed portion, and parse it via orjson.
-    If no complete JSON object is found, simply return {} instead of raising.
+    Parse the JSON object out of an LLM response. The model is prompted to
+    return pure JSON, so try orjson on the whole text first; if there is
+    surrounding chatter, fall back to json.JSONDecoder().raw_decode from the
+    first “{”, which matches brackets in C and respects string literals.
+
+    Returns (obj, raw_json) — raw_json is the validated JSON slice of the
+    input, so callers feeding it straight into the next prompt skip a
+    dumps() round-trip over multi-KB payloads. On failure: ({}, "{}").
     """
-    if not text or "{" not in text:
-        return {}
-
-    # Find the first “{”
-    start = text.find("{")
-    depth = 0
-    end = -1
-
-    for i, ch in enumerate(text[start:], start):
-        if ch == "{":
-            depth += 1
-        elif ch == "}":
-            depth -= 1
-            if depth == 0:
-                end = i
-                break
-
-    # If we never found a matching “}”, bail out with an empty dict
-    if end == -1:
-        return {}
-
-    candidate = text[start : end + 1]
+    s = text.strip() if text else ""
+    if not s:
+        return {}, "{}"
+
     try:
-        return orjson.loads(candidate)
+        obj = orjson.loads(s)
+        # Only a JSON object satisfies the contract; bare arrays/scalars
+        # fall through to the raw_decode path, which starts at the first
+        # "{" just like the original brace scan did.
+        if isinstance(obj, dict):
+            return obj, s
     except Exception:
-        # If parsing fails for any reason, return empty dict
-        return {}
+        pass
 
+    start = s.find("{")
+    if start < 0:
+        return {}, "{}"
+
+    try:
+        obj, end = json.JSONDecoder().raw_decode(s[start:])
+        return obj, s[start : start + end]
+    except json.JSONDecodeError:
+        return {}, "{}"
 
-def split_head_body(dom_html: str) -> tuple[str, str]:
-    head_match = re.search(r"<head.*?>(.*?)</head>", dom_html, flags=re.I | re.S)
-    body_match = re.search(r"<body.*?>(.*?)</body>", dom_html, flags=re.I | re.S)
 
-    head_html = head_match.group(1).strip() if head_match else ""
-    body_html = body_match.group(1).strip() if body_match else dom_html
+def _inner_section(dom_html: str, low: str, tag: str) -> str | None:
+    """Slice the inner HTML of <tag …>…</tag> using C-level str.find."""
+    open_at = low.find(f"<{tag}")
+    if open_at == -1:
+        return None
+    open_end = low.find(">", open_at)
+    close_at = low.find(f"</{tag}>", open_end)
+    if open_end == -1 or close_at == -1:
+        return None
+    return dom_html[open_end + 1 : close_at]
+
+
+def split_head_body(dom_html: str) -> tuple[str, str]:
+    # One lowercased copy for case-insensitive anchors, then constant-time
+    # slicing — no regex scan over the full document.
+    low = dom_html.lower()
+    head_html = _inner_section(dom_html, low, "head")
+    body_html = _inner_section(dom_html, low, "body")
+
+    head_html = head_html.strip() if head_html is not None else ""
+    body_html = body_html.strip() if body_html is not None else dom_html
     return head_html, body_html
 
 
 # ══════════ PROMPT BUILDERS ════════════════════════════════════════════════
 
+def _j(obj) -> str:
+    # Canonical JSON for prompt interpolation — faster than Python's list
+    # repr and keeps token counts stable across runs (better cache hits).
+    return orjson.dumps(obj).decode()
+
 def p_stage1(body_html: str, palette: list[str], fonts: list[str]) -> list[dict]:
+    # body_html arrives pre-truncated (clone_site slices the blobs once).
     system = {
         "role": "system",
         "content": (
@@ -105,9 +335,9 @@ def p_stage1(body_html: str, palette: list[str], fonts: list[str]) -> list[dict]
         "role": "user",
         "content": (
             "BODY HTML (truncated if too long):\n```\n"
-            f"{body_html[:20000]}\n"
+            f"{body_html}\n"
             "…(truncated)…\n```\n\n"
-            f"Palette: {palette}\nFonts: {fonts}"
+            f"Palette: {_j(palette)}\nFonts: {_j(fonts)}"
         ),
     }
     return [system, user]
@@ -128,7 +358,7 @@ def p_tokens(critical_css: str, palette: list[str]) -> list[dict]:
     }
     user = {
         "role": "user",
-        "content": f"CSS:\n```\n{critical_css}\n```\n\nPalette: {palette}",
+        "content": f"CSS:\n```\n{critical_css}\n```\n\nPalette: {_j(palette)}",
     }
     return [system, user]
 
@@ -149,7 +379,7 @@ def p_scss(tokens_json: str, css_links: list[str], palette: list[str]) -> list[d
         "role": "user",
         "content": (
             f"Design-tokens JSON:\n```\n{tokens_json}\n```\n"
-            f"External CSS URLs: {css_links}\nPalette: {palette}"
+            f"External CSS URLs: {_j(css_links)}\nPalette: {_j(palette)}"
         ),
     }
     return [system, user]
@@ -172,6 +402,7 @@ def p_rewrite(structure_json: str, full_html: str) -> list[dict]:
 
 
 def p_assets(dom_html: str, css_links: list[str], font_links: list[str], script_tags: list[str]) -> list[dict]:
+    # dom_html arrives pre-truncated (clone_site slices the blobs once).
     system = {
         "role": "system",
         "content": (
@@ -186,15 +417,16 @@ def p_assets(dom_html: str, css_links: list[str], font_links: list[str], script_
     user = {
         "role": "user",
         "content": (
-            f"DOM HTML:\n```\n{dom_html[:20000]}\n```\n\n"
-            f"CSS URLs: {css_links}\nFont URLs: {font_links}\n"
-            f"Script tags:\n```\n{script_tags[:20000]}\n```"
+            f"DOM HTML:\n```\n{dom_html}\n```\n\n"
+            f"CSS URLs: {_j(css_links)}\nFont URLs: {_j(font_links)}\n"
+            f"Script tags:\n```\n{_j(script_tags[:20000])}\n```"
         ),
     }
     return [system, user]
 
 
 def p_final(structure_json: str, body_html: str, css_compiled: str) -> list[dict]:
+    # body_html/css_compiled arrive pre-truncated (clone_site slices once).
     system = {
         "role": "system",
         "content": (
@@ -212,10 +444,10 @@ def p_final(structure_json: str, body_html: str, css_compiled: str) -> list[dict
         "content": (
             f"Semantic JSON:\n```\n{structure_json}\n```\n\n"
             "Rewritten <body> HTML (truncated):\n```\n"
-            f"{body_html[:100000]}\n"
+            f"{body_html}\n"
             "…(truncated)…\n```\n\n"
             "Compiled CSS (truncated):\n```\n"
-            f"{css_compiled[:50000]}\n"
+            f"{css_compiled}\n"
             "…(truncated)…\n```"
         ),
     }
@@ -224,140 +456,213 @@ def p_final(structure_json: str, body_html: str, css_compiled: str) -> list[dict
 
 # ═══════════ ASSEMBLER HELPERS ═══════════════════════════════════════════════
 
+# Above this size a real parse beats the regex passes and, unlike regex,
+# can't backtrack pathologically on malformed markup.
+_LXML_BODY_THRESHOLD = 20_000
+
+
+def _clean_body_lxml(body_html: str, origin: str) -> str | None:
+    """Strip stray meta/link/title tags and absolutize root-relative URLs
+    in one lxml parse. Returns None when the markup won't parse, in which
+    case the caller falls back to the regex path."""
+    try:
+        # Parse under an explicit throwaway parent: fromstring() would
+        # rename a multi-element fragment to a synthetic div/span, and
+        # serializing that wrapper would leak it into the document.
+        root = lxml.html.fragment_fromstring(body_html, create_parent="div")
+    except Exception:
+        return None
+
+    for node in list(root.iter("meta", "link", "title")):
+        if node.getparent() is not None:
+            node.drop_tree()
+
+    for el in root.iter():
+        for attr in ("href", "src"):
+            value = el.get(attr)
+            if value and value.startswith("/") and not value.startswith("//"):
+                el.set(attr, origin + value)
+
+    # Serialize only the children (tails included) — never the wrapper.
+    return (root.text or "") + "".join(
+        lxml.html.tostring(child, encoding="unicode") for child in root
+    )
+
+
 def assemble(head_lines: list[str], body_html: str, url: str) -> str:
     """
     Build a final HTML document by deduplicating/trimming <head> / <body> / rewiring absolute URLs.
     """
-    filtered = [line for line in head_lines if isinstance(line, str) and line.strip() != ""]
-    head_section = "<head>\n" + "\n".join(filtered) + "\n</head>"
-    full = "<!DOCTYPE html>\n<html>\n" + head_section + body_html + "\n</html>"
-
-    # Remove any extra meta, link, or <title> tags that might have been duplicated
-    prefix, sep, suffix = full.partition("</head>")
-    suffix = re.sub(r"<meta\s[^>]*?>", "", suffix, flags=re.I)
-    suffix = re.sub(r"<link\s[^>]*?>", "", suffix, flags=re.I)
-    suffix = re.sub(r"<title[^>]*?>.*?</title>", "", suffix, flags=re.I | re.S)
-    full = prefix + "</head>" + suffix
-
-    # Rewrite any leading "/" paths to absolute origin
     parsed = urlparse(url)
     origin = f"{parsed.scheme}://{parsed.netloc}"
-    full = full.replace('href="/', f'href="{origin}/')
-    full = full.replace('src="/',  f'src="{origin}/')
+    rewrite = f'\\1="{origin}/'
 
-    return full
+    # Dedup/rewrite the head and body pieces, then emit the document with
+    # a single join — no intermediate concatenations copying the pieces.
+    filtered = [line for line in head_lines if isinstance(line, str) and line.strip() != ""]
+
+    # strip any extra meta, link, or <title> duplicated into the body;
+    # large bodies go through one lxml parse, small ones stay on regex
+    body_section = None
+    if len(body_html) > _LXML_BODY_THRESHOLD:
+        body_section = _clean_body_lxml(body_html, origin)
+    if body_section is None:
+        body_section = _RE_ROOT_URL.sub(rewrite, _RE_HEAD_STRIP.sub("", body_html))
+
+    parts = [
+        "<!DOCTYPE html>\n<html>\n<head>\n",
+        _RE_ROOT_URL.sub(rewrite, "\n".join(filtered)),
+        "\n</head>",
+        body_section,
+        "\n</html>",
+    ]
+    return "".join(parts)
 
 
 # ═══════════ MAIN TASK ═══════════════════════════════════════════════════════
 
-@celery_app.task(bind=True, acks_late=True, max_retries=1)
+# soft_time_limit is enforced by the prefork pool only; under the
+# documented threads pool the effective ceiling is the per-call 30s
+# timeout x 4 attempts applied to every LLM stage.
+@celery_app.task(bind=True, acks_late=True, max_retries=1, soft_time_limit=600)
 def clone_site(self, job_id: str, url: str):
     redis_key = f"jobs:{job_id}"
     redis.hset(redis_key, mapping={"status": "running", "progress": 0})
 
+    # Progress-only updates are buffered here and flushed together with
+    # the next durable write, so each stage costs one Redis round-trip.
+    pipe = redis.pipeline(transaction=False)
+
     try:
         # ───── Stage 0: Scrape ───────────────────────────────────────────────
-        bundle: ScrapeBundle = scrape(url)
+        bundle: ScrapeBundle = _SCRAPE_POOL.submit(scrape, url).result()
 
-        tmp_dir = pathlib.Path(tempfile.gettempdir()) / f"orchids_{job_id}"
+        tmp_dir = TMP_ROOT / f"orchids_{job_id}"
         tmp_dir.mkdir(parents=True, exist_ok=True)
 
         bundle_json_path = tmp_dir / "bundle.json"
         # If ScrapeBundle has a .to_dict(), we serialize it; otherwise adapt accordingly
         try:
-            bundle_json_path.write_text(json.dumps(bundle.to_dict(), indent=2), "utf-8")
+            bundle_json_path.write_bytes(orjson.dumps(bundle.to_dict(), option=orjson.OPT_INDENT_2))
         except AttributeError:
             # Fallback: if bundle has no to_dict(), just write the raw DOM
-            bundle_json_path.write_text(json.dumps({"dom_html": bundle.dom_html}, indent=2), "utf-8")
-
-        redis.hset(redis_key, mapping={
-            "progress": 10,
-            "bundle_json": str(bundle_json_path),
-        })
+            bundle_json_path.write_bytes(orjson.dumps({"dom_html": bundle.dom_html}, option=orjson.OPT_INDENT_2))
 
-        # If your ScrapeBundle included a screenshot_path, base64‐encode it:
-        hero_b64 = ""
-        if hasattr(bundle, "screenshot_path") and pathlib.Path(bundle.screenshot_path).exists():
-            hero_bytes = open(bundle.screenshot_path, "rb").read()
-            hero_b64 = base64.b64encode(hero_bytes).decode()
+        _mark_progress(pipe, job_id, 10, {"bundle_json": str(bundle_json_path)})
+        pipe.execute()
 
         # ───── Stage 1: Semantic JSON Outline (send only <body>) ─────────────
+        # Stage 1 needs only body+palette+fonts, Stage 2 only the fetched
+        # CSS — kick off Stage 1 now and overlap it with the CSS download
+        # and the Stage-2 call.
         _, body_html_full = split_head_body(bundle.dom_html)
-        stage1_msgs = p_stage1(body_html_full, bundle.palette, bundle.font_links)
-        struct_raw = chat(stage1_msgs, model="gpt-4.1", max_tokens=8000)
-        structure = extract_json(struct_raw)
-        redis.hset(redis_key, mapping={"progress": 25})
+        # Slice the large blobs once up front; each slice copies up to
+        # 100 KB, so the prompt builders take them pre-truncated.
+        body20k = body_html_full[:20000]
+        dom20k = bundle.dom_html[:20000]
+        stage1_msgs = p_stage1(body20k, bundle.palette, bundle.font_links)
+        f_struct = _STAGE_POOL.submit(chat, stage1_msgs, model="gpt-4.1", max_tokens=8000)
 
         # ───── Stage 2: Design Tokens JSON ───────────────────────────────────
-        if bundle.css_links:
-            css_contents: list[str] = []
-            for css_url in bundle.css_links:
-                if css_url.startswith("http"):
-                    try:
-                        resp = requests.get(css_url, timeout=5)
-                        if resp.status_code == 200:
-                            css_contents.append(f"/* {css_url} */\n{resp.text}")
-                    except Exception:
-                        pass
-            critical_css = "\n".join(css_contents)
+        # Fetch all external stylesheets concurrently: wall time is the
+        # slowest response, not the sum of round-trips.
+        css_urls = [u for u in bundle.css_links if u.startswith("http")]
+        if css_urls:
+            with ThreadPoolExecutor(max_workers=min(8, len(css_urls))) as ex:
+                critical_css = "\n".join(filter(None, ex.map(_fetch_css, css_urls)))
         else:
             critical_css = ""
 
         stage2_msgs = p_tokens(critical_css, bundle.palette)
-        tokens_raw = chat(stage2_msgs, model="gpt-4.1", max_tokens=6000)
-        tokens_obj = extract_json(tokens_raw)
-        redis.hset(redis_key, mapping={
-            "progress": 40,
-            "tokens_obj": json.dumps(tokens_obj),
-        })
+        f_tokens = _STAGE_POOL.submit(chat, stage2_msgs, model="gpt-4.1", max_tokens=6000)
+
+        struct_raw = f_struct.result()
+        structure, structure_json_str = extract_json(struct_raw)
+        _mark_progress(pipe, job_id, 25)
+
+        tokens_raw = f_tokens.result()
+        tokens_obj, tokens_json_str = extract_json(tokens_raw)
+        _mark_progress(pipe, job_id, 40, {"tokens_obj": tokens_json_str})
+        pipe.execute()
 
         # ───── Stage 3: SCSS → CSS Compilation ───────────────────────────────
-        tokens_json_str = orjson.dumps(tokens_obj).decode()
+        # Stage 3 needs only tokens_obj and stages 4/5 need only the
+        # structure/bundle, so all three LLM calls fly together.
         stage3_msgs = p_scss(tokens_json_str, bundle.css_links, bundle.palette)
-        scss_code = chat(stage3_msgs, model="gpt-4.1", max_tokens=12000)
+        f_scss = _STAGE_POOL.submit(chat, stage3_msgs, model="gpt-4.1", max_tokens=12000)
 
-        # Strip out Markdown fences and remove leading “variables” if present
-        scss_clean = re.sub(r"```[^`]*scss", "", scss_code, flags=re.I).replace("```", "")
-        lines = scss_clean.splitlines()
-        if lines and lines[0].strip().lower() == "variables":
-            lines = lines[1:]
-        scss_clean = "\n".join(lines)
+        stage4_msgs = p_rewrite(structure_json_str, bundle.dom_html)
+        stage5_msgs = p_assets(dom20k, bundle.css_links, bundle.font_links, bundle.script_tags)
+        f_body = _STAGE_POOL.submit(chat, stage4_msgs, model="gpt-4.1", max_tokens=15000)
+        f_assets = _STAGE_POOL.submit(chat, stage5_msgs, model="gpt-4.1", max_tokens=6000)
 
-        try:
-            css_compiled = sass.compile(string=scss_clean, output_style="expanded")
-        except sass.CompileError:
-            css_compiled = ""  # fallback if SCSS invalid
+        scss_code = f_scss.result()
+
+        # Strip out Markdown fences and remove leading “variables” if present
+        scss_clean = _strip_fence(scss_code)
+        if "```" in scss_clean:
+            # unusual fencing the fast strip didn't fully remove
+            scss_clean = _RE_SCSS_FENCE.sub("", scss_code)
+        if scss_clean.startswith("variables\n"):
+            scss_clean = scss_clean[len("variables\n"):]
+
+        if not scss_clean.strip():
+            css_compiled = ""  # nothing to compile — skip the libsass call
+        elif _looks_like_plain_css(scss_clean):
+            css_compiled = scss_clean  # already valid CSS, no compile needed
+        else:
+            # Token sets repeat heavily across sites, so memoize the
+            # compiled CSS by content hash and skip libsass on repeats.
+            scss_key = "scss:" + hashlib.blake2b(scss_clean.encode(), digest_size=16).hexdigest()
+            cached_css = redis.get(scss_key)
+            if cached_css is not None:
+                css_compiled = cached_css
+            else:
+                try:
+                    css_compiled = sass.compile(
+                        string=scss_clean,
+                        output_style="expanded",
+                        importers=((0, _cached_import),),
+                    )
+                except sass.CompileError:
+                    css_compiled = ""  # fallback if SCSS invalid
+                redis.setex(scss_key, 86400, css_compiled)
 
         scss_path = tmp_dir / "generated.scss"
-        scss_path.write_text(scss_clean, "utf-8")
-        redis.hset(redis_key, mapping={
-            "progress": 55,
-            "scss_code": str(scss_path),
-        })
+        scss_path.write_bytes(scss_clean.encode("utf-8"))
+        _mark_progress(pipe, job_id, 55, {"scss_code": str(scss_path)})
+        pipe.execute()
 
         style_block = f"<style>\n{css_compiled}\n</style>"
 
         # ───── Stage 4: Rewrite BODY HTML ────────────────────────────────────
-        structure_json_str = orjson.dumps(structure).decode()
-        stage4_msgs = p_rewrite(structure_json_str, bundle.dom_html)
-        body_html = chat(stage4_msgs, model="gpt-4.1", max_tokens=15000)
-        redis.hset(redis_key, mapping={"progress": 70})
+        body_html = f_body.result()
+        _mark_progress(pipe, job_id, 70)
+        pipe.execute()
 
         # ───── Stage 5: Asset Inlining & Optimization ────────────────────────
-        stage5_msgs = p_assets(bundle.dom_html, bundle.css_links, bundle.font_links, bundle.script_tags)
-        assets_raw = chat(stage5_msgs, model="gpt-4.1", max_tokens=6000)
-        assets_obj = extract_json(assets_raw)
+        assets_raw = f_assets.result()
+        assets_obj, _ = extract_json(assets_raw)
 
+        # One pass over body_html regardless of how many images get inlined
+        # (the old per-image re.sub rescanned and rebuilt the whole string).
         inline_images = assets_obj.get("inline_images", [])
-        for image_info in inline_images:
-            selector = image_info.get("selector", "")
-            if selector.startswith("img"):
-                body_html = re.sub(
-                    r'<img\s+([^>]*?)src="[^"]+"(.*?)>',
-                    f'<img \\1src="data:image/png;base64,{hero_b64}"\\2>',
-                    body_html,
-                    count=1
-                )
+        inline_count = sum(
+            1 for info in inline_images if info.get("selector", "").startswith("img")
+        )
+        # Only materialize the (large) base64 string if something actually
+        # gets inlined — most jobs never touch it.
+        hero_b64 = _hero_b64(bundle) if inline_count else ""
+        if inline_count and hero_b64:
+            remaining = [inline_count]
+
+            def _inline_hero(match):
+                if remaining[0] == 0:
+                    return match.group(0)
+                remaining[0] -= 1
+                return f'<img {match.group(1)}src="data:image/png;base64,{hero_b64}"{match.group(2)}>'
+
+            body_html = _RE_IMG.sub(_inline_hero, body_html)
 
         needs_font_preload = assets_obj.get("needs_font_preload", False)
         updated_scripts   = assets_obj.get("updated_script_tags", [])
@@ -368,21 +673,25 @@ def clone_site(self, job_id: str, url: str):
         for updated in updated_scripts:
             script_lines.append(updated)
 
-        redis.hset(redis_key, mapping={"progress": 80})
+        _mark_progress(pipe, job_id, 80)
+        pipe.execute()
 
         # ───── Stage 6: Final QA Pass (send truncated inputs) ────────────────
         full_body_html = f"<body>\n{body_html}\n</body>"
-        stage6_msgs = p_final(structure_json_str, full_body_html, css_compiled)
+        stage6_msgs = p_final(structure_json_str, full_body_html[:100000], css_compiled[:50000])
         final_html_raw = chat(stage6_msgs, model="gpt-4.1", max_tokens=20000)
-        redis.hset(redis_key, mapping={"progress": 90})
+        _mark_progress(pipe, job_id, 90)
+        pipe.execute()
 
         # ───── Assemble head + body ──────────────────────────────────────────
         head_lines: list[str] = [
             '<meta charset="UTF-8">',
             '<meta name="viewport" content="width=device-width, initial-scale=1">',
-            *[m for m in bundle.meta_tags if m and "charset" not in m.lower() and "viewport" not in m.lower()],
-            *[f'<link rel="icon" href="{href}">' for href in bundle.link_icons],
-            *[f'<link rel="stylesheet" href="{href}">' for href in bundle.css_links],
+            *[m for m in bundle.meta_tags if m and not _META_DROP(m)],
+            # single joined block per tag kind — no per-href list unpacking;
+            # empty lists yield "" which assemble() filters out
+            "\n".join('<link rel="icon" href="%s">' % href for href in bundle.link_icons),
+            "\n".join('<link rel="stylesheet" href="%s">' % href for href in bundle.css_links),
             style_block,
             *script_lines
         ]
@@ -393,16 +702,20 @@ def clone_site(self, job_id: str, url: str):
             final_html = assemble(head_lines, final_html_raw, url)
 
         html_fp = tmp_dir / "index.html"
-        html_fp.write_text(final_html, "utf-8")
+        html_fp.write_bytes(final_html.encode("utf-8"))
 
-        redis.hset(redis_key, mapping={
+        # Terminal state stays on the hash for durability; subscribers also
+        # see the final 100 on the progress channel.
+        _mark_progress(pipe, job_id, 100, {
             "status":    "complete",
-            "progress":  "100",
             "html_path": str(html_fp),
         })
+        pipe.execute()
 
     except Exception as exc:
-        # If anything goes wrong, record the traceback & mark status="error"
+        # If anything goes wrong, drop any buffered progress updates and
+        # record the traceback & mark status="error" in one round trip
+        pipe.reset()
         tb = traceback.format_exc()
         redis.hset(redis_key, mapping={
             "status": "error",